@@ -15,11 +15,73 @@
 
 import os
 
-from Bio import SeqIO
-
 from .logconfig import LogConfig
 logger = LogConfig.getLogger(__file__)
 
+# GenBank feature table layout: feature keys start in column 5, qualifiers
+# and continuation lines are indented further
+GBK_FEATURE_KEY_COL = 5
+
+def _find_cand_cluster_smiles(lines):
+    """Scan the lines of a GenBank file for the SMILES qualifier of the first cand_cluster feature.
+
+    This only looks at the feature tables and skips over everything else (in 
+    particular the sequence data), which is much faster than parsing the whole
+    file with Bio.SeqIO when this is the only value needed.
+
+    Args:
+        lines: an iterable of lines from a GenBank file (e.g. an open file object)
+
+    Returns:
+        None if there is no cand_cluster feature. Otherwise the value of its SMILES 
+        qualifier with any quotes removed and continuation lines joined by spaces, 
+        or an empty string if it doesn't have one. 
+    """
+    in_features, in_cand_cluster = False, False
+    # parts of a quoted value which continues over multiple lines
+    smiles_parts = None 
+
+    for line in lines:
+        if smiles_parts is not None:
+            part = line.strip()
+            smiles_parts.append(part)
+            if part.endswith('"'):
+                return ' '.join(smiles_parts).strip('"')
+            continue
+
+        if not in_features:
+            if line.startswith('FEATURES'):
+                in_features = True
+            continue
+
+        if not line.startswith(' '):
+            # reached the end of the feature table for this record (ORIGIN, CONTIG, ...)
+            if in_cand_cluster:
+                return ''
+            in_features = False
+            continue
+
+        if len(line) > GBK_FEATURE_KEY_COL and line[GBK_FEATURE_KEY_COL] != ' ':
+            # start of a new feature
+            if in_cand_cluster:
+                return ''
+            in_cand_cluster = line[GBK_FEATURE_KEY_COL:].split(None, 1)[0] == 'cand_cluster'
+            continue
+
+        if in_cand_cluster:
+            qualifier = line.strip()
+            if qualifier.startswith('/SMILES='):
+                value = qualifier[len('/SMILES='):]
+                if value.startswith('"') and (len(value) == 1 or not value.endswith('"')):
+                    smiles_parts = [value]
+                    continue
+                return value.strip('"')
+
+    if in_cand_cluster or smiles_parts is not None:
+        return ' '.join(smiles_parts or []).strip('"')
+
+    return None
+
 def get_smiles(bgc):
     if bgc.antismash_file is None:
         return None
@@ -29,20 +91,14 @@ def get_smiles(bgc):
         return None
 
     with open(bgc.antismash_file, 'r') as f:
-        for rec in SeqIO.parse(f, 'gb'):
-            # rec is a Bio.SeqRecord object, search its .features list 
-            # for "cand_cluster" and then extract SMILES string from there
-            # TODO is this always correct or can it appear in other places?
-            for feature in rec.features:
-                if feature.type == 'cand_cluster':
-                    smiles = feature.qualifiers.get('SMILES', None)
-                    if smiles is None: 
-                        return None
-
-                    # always a list (TODO?)
-                    if len(smiles[0]) == 0:
-                        return None
-
-                    # seem to get space chars in some of these, which are not allowed
-                    # by the SMILES spec, so strip them out here
-                    return smiles[0].replace(' ', '')
+        # search the features of each record for "cand_cluster" and then
+        # extract SMILES string from there
+        # TODO is this always correct or can it appear in other places?
+        smiles = _find_cand_cluster_smiles(f)
+
+    if smiles is None or len(smiles) == 0:
+        return None
+
+    # seem to get space chars in some of these, which are not allowed
+    # by the SMILES spec, so strip them out here
+    return smiles.replace(' ', '')
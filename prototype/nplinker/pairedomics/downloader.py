@@ -13,17 +13,22 @@
 # limitations under the License.
 
 
+import asyncio
 import time
 import os
 import zipfile
 import json
 import io
-import re
 import tarfile
 import csv
+import pickle
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 
 import httpx
-from bs4 import BeautifulSoup
+import ijson
+from lxml import html as lxmlhtml
 from progress.bar import Bar
 from progress.spinner import Spinner
 
@@ -52,6 +57,180 @@ MIBIG_JSON_URL = 'https://dl.secondarymetabolites.org/mibig/mibig_json_{}.tar.gz
 
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:86.0) Gecko/20100101 Firefox/86.0'
 
+# settings for the HTTP clients used by the Downloader. these are kept open for
+# the lifetime of the object so that connections can be reused between requests
+HTTP_CLIENT_HEADERS = {'User-Agent': 'nplinker'}
+HTTP_CLIENT_TIMEOUT = 30.0
+# if available, HTTP/2 allows concurrent requests to the same host to share
+# a single connection (httpx needs the optional h2 package for this). httpx will
+# also request brotli-compressed responses automatically if the brotli package
+# is installed
+HTTP_CLIENT_HTTP2 = importlib.util.find_spec('h2') is not None
+
+# number of antiSMASH downloads allowed to run at the same time, and the size of
+# the connection pool shared between them
+ANTISMASH_DOWNLOAD_CONCURRENCY = 5
+ANTISMASH_MAX_CONNECTIONS = 8
+
+# number of threads used to resolve genome IDs via NCBI/JGI. NCBI starts rejecting
+# requests from clients making more than ~3 requests/second, so keep this low
+GENOME_LOOKUP_WORKERS = 3
+
+# size of the chunks downloads are read in, and how often (in bytes) to redraw
+# the progress bar while downloading. redrawing it for every chunk can take a
+# noticeable fraction of the total time on a fast connection
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+PROGRESS_UPDATE_BYTES = 1 << 20
+
+# how many times to retry a request that was rejected with a 429 (Too Many Requests),
+# and how long to wait if the server doesn't supply a Retry-After header
+HTTP_RETRY_ATTEMPTS = 3
+HTTP_RETRY_DELAY_DEFAULT = 5.0
+
+# prefixes of the files/directories wanted from the GNPS metabolomics zip
+GNPS_ZIP_MEMBER_PREFIXES = ('clusterinfosummarygroup_attributes_withIDs_withcomponentID',
+                            'networkedges_selfloop',
+                            'quantification_table',
+                            'metadata_table',
+                            'DB_result',
+                            'result_specnets_DB')
+
+def _retry_after(resp):
+    # Retry-After can be either a number of seconds or an HTTP date, only
+    # bother handling the first case and fall back to a fixed delay otherwise
+    try:
+        return float(resp.headers.get('retry-after', HTTP_RETRY_DELAY_DEFAULT))
+    except ValueError:
+        return HTTP_RETRY_DELAY_DEFAULT
+
+def _run_coroutine(coro):
+    # asyncio.run can't be used if this thread already has an event loop running
+    # (e.g. in a Jupyter notebook or a bokeh/tornado callback). in that case run
+    # the coroutine in a new loop on a worker thread and wait for it to finish
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(asyncio.run, coro).result()
+
+def _extract_zip_members(zip_path, members, output_path):
+    # each worker thread needs its own ZipFile handle, they can't be shared safely
+    with zipfile.ZipFile(zip_path) as zf:
+        for member in members:
+            zf.extract(member, path=output_path)
+
+def _range_request(part_path):
+    # if there is a partial download at part_path, return its size and the headers
+    # needed to request the remainder of the file
+    have = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Range': 'bytes={}-'.format(have)} if have > 0 else {}
+    return have, headers
+
+def _resume_offset(resp, part_path, have):
+    # returns the offset the content of resp starts at: either the size of the
+    # existing partial download or 0 if the server is sending the whole file
+    # (e.g. because it ignored the Range header). returns None if the partial
+    # download turns out to contain the whole file already
+    if have == 0:
+        return 0
+
+    if resp.status_code == httpx.codes.REQUESTED_RANGE_NOT_SATISFIABLE:
+        # if the previous run was interrupted after the last byte arrived but
+        # before the file was renamed, the range starts at the end of the file
+        if resp.headers.get('content-range', '') == 'bytes */{}'.format(have):
+            return None
+
+        os.unlink(part_path)
+        raise Exception('Server rejected request to resume {}, will restart the download next time'.format(resp.url))
+
+    if resp.status_code != httpx.codes.PARTIAL_CONTENT:
+        return 0
+
+    content_range = resp.headers.get('content-range', '')
+    if not content_range.startswith('bytes {}-'.format(have)):
+        os.unlink(part_path)
+        raise Exception('Unexpected Content-Range "{}" for {}, will restart the download next time'.format(content_range, resp.url))
+
+    return have
+
+class ThrottledLookupError(Exception):
+    """
+    Raised when a genome ID lookup is still being rejected with 429 (Too Many
+    Requests) after retrying. This is a temporary failure, so unlike other 
+    failed lookups it shouldn't be recorded in the genome status file.
+    """
+    pass
+
+class ThrottledProgress(object):
+    """
+    Wrapper for a progress.bar.Bar that only redraws it every PROGRESS_UPDATE_BYTES
+    """
+
+    def __init__(self, bar, start=0):
+        self._bar = bar
+        self._total = start
+        self._last_total = start
+        self._bar.goto(start)
+
+    def update(self, data):
+        self._total += len(data)
+        if self._total - self._last_total >= PROGRESS_UPDATE_BYTES:
+            self._bar.goto(self._total)
+            self._last_total = self._total
+
+    def finish(self):
+        self._bar.goto(self._total)
+        self._bar.finish()
+
+class ResponseStream(io.RawIOBase):
+    """
+    Read-only file-like wrapper around the chunks of a streamed HTTP response
+
+    This allows things like tarfile to consume a download as it arrives. Each
+    chunk is also written to copy_file (if given) so the download can be kept,
+    and passed to callback (if given) to allow progress to be reported. 
+    """
+
+    def __init__(self, chunks, copy_file=None, callback=None):
+        self._chunks = iter(chunks)
+        self._copy_file = copy_file
+        self._callback = callback
+        self._buf = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self):
+        data = next(self._chunks)
+        if self._copy_file is not None:
+            self._copy_file.write(data)
+        if self._callback is not None:
+            self._callback(data)
+        return data
+
+    def readinto(self, b):
+        while len(self._buf) == 0:
+            try:
+                self._buf = memoryview(self._next_chunk())
+            except StopIteration:
+                return 0
+
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+    def drain(self):
+        """Consume the rest of the response (e.g. any trailing padding a reader has ignored)"""
+        self._buf = memoryview(b'')
+        while True:
+            try:
+                self._next_chunk()
+            except StopIteration:
+                break
+
 class GenomeStatus:
 
     def __init__(self, original_id, resolved_id, attempted=False, filename=""):
@@ -67,7 +246,13 @@ class GenomeStatus:
     def to_csv(self):
         return ','.join([str(self.original_id), str(self.resolved_id), str(self.attempted), self.filename])
 
-def download_and_extract_mibig_json(download_path, output_path, version='1.4'):
+def download_and_extract_mibig_json(download_path, output_path, version='1.4', client=None):
+    # nothing to do if the data was extracted on a previous run, don't even need
+    # to check the archive in that case
+    if os.path.exists(os.path.join(output_path, 'completed')):
+        logger.debug('MiBIG JSON data already extracted to {}'.format(output_path))
+        return True
+
     archive_path = os.path.join(download_path, 'mibig_json_{}.tar.gz'.format(version))
     logger.debug('Checking for existing MiBIG archive at {}'.format(archive_path))
     cached = False
@@ -80,29 +265,55 @@ def download_and_extract_mibig_json(download_path, output_path, version='1.4'):
             logger.info('Invalid MiBIG archive found, will download again')
             os.unlink(archive_path)
 
+    # extract and rename to "mibig_json"
+    # TODO annoyingly the 2.0 version has been archived with a subdirectory, while
+    # 1.4 just dumps all the files into the current directory, so if/when 2.0 support
+    # is required this will need to handle both cases
+
     if not cached:
         url = MIBIG_JSON_URL.format(version)
-        with open(archive_path, 'wb') as f:
-            total_bytes, last_total = 0, 0
-            with httpx.stream('GET', url) as r:
-                filesize = int(r.headers['content-length'])
-                bar = Bar(url, max=filesize, suffix='%(percent)d%%')
-                for data in r.iter_bytes():
-                    f.write(data)
-                    total_bytes += len(data)
-                    bar.next(len(data))
+        # use the caller's client if there is one, otherwise a one-off connection
+        http = client if client is not None else httpx
+        # the archive is downloaded to a .part file first, so if the download is 
+        # interrupted it can be resumed from the same point next time
+        part_path = archive_path + '.part'
+        have, headers = _range_request(part_path)
+        with http.stream('GET', url, headers=headers) as r:
+            offset = _resume_offset(r, part_path, have)
+            if offset is None:
+                # nothing left to download, just extract it below
+                logger.info('MiBIG archive was already fully downloaded to {}'.format(part_path))
+            elif offset > 0:
+                # the start of the archive is already on disk, so can't extract it
+                # as it arrives here. just append the rest and extract it below
+                logger.info('Resuming MiBIG download from byte {}'.format(offset))
+                bar = ThrottledProgress(Bar(url, max=offset + int(r.headers['content-length']), suffix='%(percent)d%%'), offset)
+                with open(part_path, 'ab') as f:
+                    for data in r.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(data)
+                        bar.update(data)
+                bar.finish()
+            else:
+                bar = ThrottledProgress(Bar(url, max=int(r.headers['content-length']), suffix='%(percent)d%%'))
+                with open(part_path, 'wb') as f:
+                    # extract the archive as it's downloaded rather than reading it
+                    # back from disk afterwards, still keeping a copy for next time
+                    logger.debug('Extracting MiBIG JSON data')
+                    stream = ResponseStream(r.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE), f, bar.update)
+                    with tarfile.open(fileobj=stream, mode='r|gz') as mibig_gz:
+                        mibig_gz.extractall(path=os.path.join(output_path))
+                    stream.drain()
                 bar.finish()
+
+        os.replace(part_path, archive_path)
+
+        if offset == 0:
+            open(os.path.join(output_path, 'completed'), 'w').close()
+            return True
     
     logger.debug('Extracting MiBIG JSON data')
 
-    if os.path.exists(os.path.join(output_path, 'completed')):
-        return True
-
     mibig_gz = tarfile.open(archive_path, 'r:gz')
-    # extract and rename to "mibig_json"
-    # TODO annoyingly the 2.0 version has been archived with a subdirectory, while
-    # 1.4 just dumps all the files into the current directory, so if/when 2.0 support
-    # is required this will need to handle both cases
     mibig_gz.extractall(path=os.path.join(output_path))
     # os.rename(os.path.join(self.project_file_cache, 'mibig_json_{}'.format(version)), os.path.join(self.project_file_cache, 'mibig_json'))
 
@@ -115,21 +326,25 @@ def generate_strain_mappings(strains, strain_mappings_file, antismash_dir):
     if not os.path.exists(strain_mappings_file):
         logger.info('Generating strain mappings file')
         for root, dirs, files in os.walk(antismash_dir):
-            for f in files: 
-                if not f.endswith('.gbk'):
-                    continue
-
-                # use the containing folder of the .gbk file as the strain name,
-                # and then take everything but ".gbk" from the filename and use 
-                # that as an alias
-                strain_name = os.path.split(root)[1]
+            gbk_files = [f for f in files if f.endswith('.gbk')]
+            if len(gbk_files) == 0:
+                continue
+
+            # use the containing folder of the .gbk file as the strain name,
+            # and then take everything but ".gbk" from the filename and use 
+            # that as an alias. since every .gbk in the folder has the same 
+            # strain name, only need to look it up once
+            strain_name = os.path.split(root)[1]
+            strain = strains.lookup(strain_name)
+            if strain is None:
+                logger.warning('Failed to lookup strain name: {}'.format(strain_name))
+                continue
+
+            for f in gbk_files: 
                 strain_alias = os.path.splitext(f)[0]
                 if strain_alias.find('.') != -1:
                     strain_alias = strain_alias[:strain_alias.index('.')]
-                if strains.lookup(strain_name) is not None:
-                    strains.lookup(strain_name).add_alias(strain_alias)
-                else:
-                    logger.warning('Failed to lookup strain name: {}'.format(strain_name))
+                strain.add_alias(strain_alias)
         logger.info('Saving strains to {}'.format(strain_mappings_file))
         strains.save_to_file(strain_mappings_file)
     else:
@@ -147,11 +362,25 @@ class Downloader(object):
         self.local_download_cache = os.path.join(self.local_cache, 'downloads')
         self.local_file_cache = os.path.join(self.local_cache, 'extracted')
         self.all_project_json_file = os.path.join(self.local_cache, 'all_projects.json')
-        self.all_project_json = None
+        self.all_project_index_file = os.path.join(self.local_cache, 'all_projects_index.pckl')
         self.project_json_file = os.path.join(self.local_cache, '{}.json'.format(self.gnps_massive_id))
         self.project_json = None
+        # GenBank => RefSeq accession mappings are looked up via NCBI, which is slow, and 
+        # they never change, so successful lookups are cached to disk and shared by all projects
+        self.genbank_cache_file = os.path.join(self.local_cache, 'genbank_refseq.json')
+        self.genbank_cache = {}
+        self._genbank_cache_updated = False
         os.makedirs(self.local_cache, exist_ok=True)
 
+        if os.path.exists(self.genbank_cache_file):
+            try:
+                with open(self.genbank_cache_file, 'r') as f:
+                    self.genbank_cache = json.load(f)
+            except ValueError as ve:
+                logger.warning('Failed to load GenBank accession cache {} ({}), will recreate it'.format(self.genbank_cache_file, ve))
+
+        self._client = self._new_client()
+
         self.json_data = None
         self.strains = StrainCollection()
         self.growth_media = {}
@@ -160,11 +389,9 @@ class Downloader(object):
 
         if not os.path.exists(self.project_json_file) or force_download:
             logger.info('Downloading new copy of platform project data...')
-            self.all_project_json = self._download_platform_json_to_file(PAIREDOMICS_PROJECT_DATA_ENDPOINT, self.all_project_json_file)
+            self._download_platform_file(PAIREDOMICS_PROJECT_DATA_ENDPOINT, self.all_project_json_file)
         else:
             logger.info('Using existing copy of platform project data')
-            with open(self.all_project_json_file, 'r') as f:
-                self.all_project_json = json.load(f)
 
         # query the pairedomics webservice with the project ID to retrieve the data. unfortunately
         # this is not the MSV... ID, but an internal GUID string. To get that, first need to get the
@@ -172,14 +399,10 @@ class Downloader(object):
         # then extract its '_id' value to get the GUID
 
         # find the specified project and store its ID
-        for project in self.all_project_json['data']:
-            pairedomics_id = project['_id']
-            gnps_massive_id = project['metabolite_id']
-
-            if gnps_massive_id == platform_id:
-                self.pairedomics_id = pairedomics_id
-                logger.debug('platform_id {} matched to pairedomics_id {}'.format(self.gnps_massive_id, self.pairedomics_id))
-                break
+        project_index = self._load_project_index(self.all_project_json_file, self.all_project_index_file)
+        self.pairedomics_id = project_index.get(platform_id, None)
+        if self.pairedomics_id is not None:
+            logger.debug('platform_id {} matched to pairedomics_id {}'.format(self.gnps_massive_id, self.pairedomics_id))
 
         if self.pairedomics_id is None:
             raise Exception('Failed to find a pairedomics project with ID {}'.format(self.gnps_massive_id))
@@ -187,11 +410,12 @@ class Downloader(object):
         # now get the project JSON data
         logger.info('Found project, retrieving JSON data...')
         self.project_json = self._download_platform_json_to_file(PAIREDOMICS_PROJECT_URL.format(self.pairedomics_id), self.project_json_file)
-        
-        if 'molecular_network' not in self.project_json['metabolomics']['project']:
+
+        metabolomics_project = self.project_json['metabolomics']['project']
+        if 'molecular_network' not in metabolomics_project:
             raise Exception('Dataset has no GNPS data URL!')
 
-        self.gnps_task_id = self.project_json['metabolomics']['project']['molecular_network']
+        self.gnps_task_id = metabolomics_project['molecular_network']
 
         # create local cache folders for this dataset
         self.project_download_cache = os.path.join(self.local_download_cache, self.gnps_massive_id)
@@ -205,18 +429,46 @@ class Downloader(object):
             os.makedirs(os.path.join(self.project_file_cache, d), exist_ok=True)
 
         with io.open(os.path.join(self.project_file_cache, 'platform_data.json'), 'w', encoding='utf-8') as f:
-            f.write(str(self.project_json))
+            json.dump(self.project_json, f)
 
         self.strain_mappings_file = os.path.join(self.project_file_cache, 'strain_mappings.csv')
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # release any pooled connections
+        self._client.close()
+
+    def _new_client(self):
+        return httpx.Client(headers=HTTP_CLIENT_HEADERS, timeout=HTTP_CLIENT_TIMEOUT, http2=HTTP_CLIENT_HTTP2)
+
     def get(self, do_bigscape, extra_bigscape_parameters):
-        logger.info('Going to download the metabolomics data file')
+        # get() may be called more than once (e.g. reloading a dataset), so the
+        # client is reopened here if a previous call closed it
+        if self._client.is_closed:
+            self._client = self._new_client()
+
+        try:
+            logger.info('Going to download the metabolomics data file')
+
+            genomes = self.project_json['genomes']
+            self._download_metabolomics_zipfile(self.gnps_task_id)
+            try:
+                self._download_genomics_data(genomes)
+            finally:
+                # keep any accessions resolved so far even if something went wrong
+                self._save_genbank_cache()
+            self._parse_genome_labels(self.project_json['genome_metabolome_links'], genomes)
+            self._generate_strain_mappings()
+            self._download_mibig_json() # TODO version
+        finally:
+            # nothing else needs the connections once the downloads are done
+            self.close()
 
-        self._download_metabolomics_zipfile(self.gnps_task_id)
-        self._download_genomics_data(self.project_json['genomes'])
-        self._parse_genome_labels(self.project_json['genome_metabolome_links'], self.project_json['genomes'])
-        self._generate_strain_mappings()
-        self._download_mibig_json() # TODO version
         self._run_bigscape(do_bigscape, extra_bigscape_parameters) 
 
     def _is_new_gnps_format(self, directory):
@@ -239,10 +491,24 @@ class Downloader(object):
     def _generate_strain_mappings(self):
         gen_strains = generate_strain_mappings(self.strains, self.strain_mappings_file, os.path.join(self.project_file_cache, 'antismash'))
 
+    def _throttled_get(self, url, **kwargs):
+        # sync equivalent of _async_get. this is called from several threads at once,
+        # so the lookup sites may start rejecting requests
+        for attempt in range(HTTP_RETRY_ATTEMPTS):
+            resp = self._client.get(url, **kwargs)
+            if resp.status_code != httpx.codes.TOO_MANY_REQUESTS:
+                return resp
+
+            delay = _retry_after(resp)
+            logger.debug('Request for {} was throttled, trying again in {} seconds'.format(url, delay))
+            time.sleep(delay)
+
+        raise ThrottledLookupError('Request for {} was throttled {} times'.format(url, HTTP_RETRY_ATTEMPTS))
+
     def _ncbi_genbank_search(self, genbank_id, retry=True, retry_time=3.0):
         url = NCBI_LOOKUP_URL_NEW.format(genbank_id)
         logger.debug('Looking up GenBank data at {}'.format(url))
-        resp = httpx.get(url)
+        resp = self._throttled_get(url)
         if resp.status_code == httpx.codes.OK:
             return resp.content
 
@@ -252,14 +518,38 @@ class Downloader(object):
             # fail even though it should produce a valid result so maybe some
             # throttling going on?
             time.sleep(retry_time)
-            resp = httpx.get(url)
+            resp = self._throttled_get(url)
             if resp.status_code == httpx.codes.OK:
                 return resp.content
 
         logger.warning('HTTP error {} resolving GenBank accession {} (URL was {})'.format(resp.status_code, genbank_id, url))
         return None
 
+    def _save_genbank_cache(self):
+        if not self._genbank_cache_updated:
+            return
+
+        logger.debug('Saving {} GenBank accession mappings to {}'.format(len(self.genbank_cache), self.genbank_cache_file))
+        with open(self.genbank_cache_file, 'w') as f:
+            json.dump(self.genbank_cache, f)
+        self._genbank_cache_updated = False
+
     def _resolve_genbank_accession(self, genbank_id):
+        # only successful lookups are cached, failures are recorded per-project
+        # in the genome status file instead
+        refseq_id = self.genbank_cache.get(genbank_id, None)
+        if refseq_id is not None:
+            logger.info('Using cached RefSeq accession {} for Genbank accession {}'.format(refseq_id, genbank_id))
+            return refseq_id
+
+        refseq_id = self._lookup_genbank_accession(genbank_id)
+        if refseq_id is not None:
+            self.genbank_cache[genbank_id] = refseq_id
+            self._genbank_cache_updated = True
+
+        return refseq_id
+
+    def _lookup_genbank_accession(self, genbank_id):
         logger.info('Attempting to resolve RefSeq accession from Genbank accession {}'.format(genbank_id))
         # genbank id => genbank seq => refseq
 
@@ -285,30 +575,26 @@ class Downloader(object):
             if content is None:
                 raise Exception('HTTP connection error')
 
-            soup = BeautifulSoup(content, 'html.parser')
+            root = lxmlhtml.fromstring(content)
             # find the <dl> element with class "assembly_summary_new"
-            dl_element = soup.find('dl', {'class': 'assembly_summary_new'})
-            if dl_element is None:
+            dl_elements = root.xpath('//dl[contains(concat(" ", normalize-space(@class), " "), " assembly_summary_new ")]')
+            if len(dl_elements) == 0:
                 raise Exception('Unknown HTML format')
 
-            refseq_idx = -1
-            for field_idx, field in enumerate(dl_element.children):
-                # this is the element immediately preceding the one with
-                # the actual RefSeq ID we want
-                if field.getText().strip() == 'RefSeq assembly accession:':
-                    refseq_idx = field_idx + 1
-
-                # this should be True when we've reached the right element
-                if field_idx == refseq_idx:
-                    refseq_id = field.getText()
-                    # if it has any spaces, take everything up to first one (some have annotations afterwards)
-                    if refseq_id.find(' ') != -1:
-                        refseq_id = refseq_id[:refseq_id.find(' ')]
-                
-                    return refseq_id
-
-            if refseq_idx == -1:
+            # the RefSeq ID we want is in the element immediately following
+            # the "RefSeq assembly accession:" label
+            fields = dl_elements[0].xpath('*[normalize-space(.)="RefSeq assembly accession:"]/following-sibling::*[1]')
+            if len(fields) == 0:
                 raise Exception('Expected HTML elements not found')
+
+            refseq_id = fields[0].text_content()
+            # if it has any spaces, take everything up to first one (some have annotations afterwards)
+            if refseq_id.find(' ') != -1:
+                refseq_id = refseq_id[:refseq_id.find(' ')]
+
+            return refseq_id
+        except ThrottledLookupError:
+            raise
         except Exception as e:
             logger.warning('Failed resolving GenBank accession {}, error {}'.format(genbank_id, e))
 
@@ -319,18 +605,23 @@ class Downloader(object):
         logger.info('Attempting to resolve JGI_Genome_ID to GenBank accession')
         # no User-Agent header produces a 403 Forbidden error on this site...
         try:
-            resp = httpx.get(url, headers={'User-Agent': USER_AGENT}, timeout=10.0)
+            resp = self._throttled_get(url, headers={'User-Agent': USER_AGENT}, timeout=10.0)
         except httpx.ReadTimeout:
             logger.warning('Timed out waiting for result of JGI_Genome_ID lookup')
             return None
 
-        soup = BeautifulSoup(resp.content, 'html.parser')
+        try:
+            root = lxmlhtml.fromstring(resp.content)
+        except Exception as e:
+            logger.warning('Failed to parse result of JGI_Genome_ID lookup: {}'.format(e))
+            return None
+
         # find the table entry giving the NCBI assembly accession ID
-        link = soup.find('a', href=re.compile('https://www.ncbi.nlm.nih.gov/nuccore/.*'))
-        if link is None:
+        links = root.xpath('//a[contains(@href, "https://www.ncbi.nlm.nih.gov/nuccore/")]')
+        if len(links) == 0:
             return None
         
-        return self._resolve_genbank_accession(link.text)
+        return self._resolve_genbank_accession(links[0].text_content())
 
     def _get_best_available_genome_id(self, genome_id_data):
         if 'RefSeq_accession' in genome_id_data:
@@ -364,12 +655,31 @@ class Downloader(object):
         # each time the app is loaded (this can take a lot of time if there are dozens of genomes)
         genome_status_file = os.path.join(self.project_download_cache, 'genome_status.txt')
 
-        # genome lookup status info
+        # genome lookup status info. entries are appended to the file as each lookup
+        # or download finishes, so that an interrupted run doesn't lose any progress.
+        # this means an ID can appear more than once, and the last entry is the
+        # most recent one
         if os.path.exists(genome_status_file):
+            num_entries = 0
             with open(genome_status_file, 'r') as f:
                 for line in csv.reader(f):
                     asobj = GenomeStatus.from_csv(*line)
                     genome_status[asobj.original_id] = asobj
+                    num_entries += 1
+
+            # drop any outdated entries. the compacted file is written separately and
+            # then moved into place, so a crash here can't truncate the original
+            if num_entries > len(genome_status):
+                part_path = genome_status_file + '.part'
+                with open(part_path, 'w', newline='\n') as f:
+                    for obj in genome_status.values():
+                        f.write(obj.to_csv()+'\n')
+                os.replace(part_path, genome_status_file)
+
+        # genomes which need to have their IDs resolved and then their antiSMASH data
+        # downloaded. both of these steps are run concurrently once all the records
+        # have been checked ({best_id: (genome_obj, [genome_record, ...])})
+        lookups = {}
 
         for i, genome_record in enumerate(genome_records):
             label = genome_record['genome_label']
@@ -380,6 +690,11 @@ class Downloader(object):
                 logger.warning('Ignoring genome record "{}" due to missing genome ID field'.format(genome_record))
                 continue
 
+            # the same genome may appear in multiple records, no need to download it twice
+            if best_id in lookups:
+                lookups[best_id][1].append(genome_record)
+                continue
+
             # use this to check if the lookup has already been attempted and if
             # so if the file is cached locally
             if best_id not in genome_status:
@@ -400,52 +715,129 @@ class Downloader(object):
             else:
                 # if no existing file and no lookup attempted, can start process of
                 # trying to retrieve the data
+                lookups[best_id] = (genome_obj, [genome_record])
+                continue
 
-                # lookup the ID
-                logger.info('Beginning lookup process for genome ID {}'.format(best_id))
-
-                genome_obj.resolved_id = self._resolve_genome_id_data(genome_record['genome_ID'])
-                genome_obj.attempted = True
-
-                if genome_obj.resolved_id is None:
-                    # give up on this one
-                    logger.warning('Failed lookup for genome ID {}'.format(best_id))
-                    with open(genome_status_file, 'a+') as f:
-                        f.write(genome_obj.to_csv()+'\n')
-                    continue
-
-                # if we got a refseq ID, now try to download the data from antismash
-                if self._download_antismash_zip(genome_obj):
-                    logger.info('Genome data successfully downloaded for {}'.format(best_id))
-                    genome_record['resolved_id'] = genome_obj.resolved_id
-                else:
-                    logger.warning('Failed to download antiSMASH data for genome ID {} ({})'.format(genome_obj.resolved_id, genome_obj.original_id))
-
+            if not self._extract_antismash_zip(genome_obj) and not genome_obj.attempted:
+                # the cached file was invalid and has been removed, record that
                 with open(genome_status_file, 'a+', newline='\n') as f:
                     f.write(genome_obj.to_csv()+'\n')
 
-            self._extract_antismash_zip(genome_obj)
+        # lookup the IDs. this is mostly waiting on NCBI/JGI so can use a thread pool
+        downloads = []
+        if len(lookups) > 0:
+            logger.info('Resolving {} genome IDs'.format(len(lookups)))
+            status_lock = threading.Lock()
+            with ThreadPoolExecutor(max_workers=GENOME_LOOKUP_WORKERS) as ex:
+                resolved = list(ex.map(lambda lookup: self._process_genome_record(lookup[0], lookup[1][0], genome_status_file, status_lock), lookups.values()))
+
+            # if we got a refseq ID, now try to download the data from antismash
+            downloads = [lookup for lookup, ok in zip(lookups.values(), resolved) if ok]
+
+        if len(downloads) > 0:
+            # different genome IDs can resolve to the same accession, and downloading
+            # those at the same time would have them writing to the same files. so 
+            # only download each accession once, and then copy the result to any 
+            # other genomes that share it ({resolved_id: [(genome_obj, [genome_record, ...]), ...]})
+            downloads_by_accession = {}
+            for genome_obj, records in downloads:
+                downloads_by_accession.setdefault(genome_obj.resolved_id, []).append((genome_obj, records))
+
+            logger.info('Downloading antiSMASH data for {} genomes'.format(len(downloads_by_accession)))
+            results = _run_coroutine(self._download_antismash_zips([group[0][0] for group in downloads_by_accession.values()]))
+
+            for group, downloaded in zip(downloads_by_accession.values(), results):
+                downloaded_obj = group[0][0]
+                for genome_obj, records in group:
+                    # the antiSMASH lookup may have changed the resolved ID (adding a .1 suffix)
+                    genome_obj.resolved_id = downloaded_obj.resolved_id
+                    genome_obj.filename = downloaded_obj.filename
+
+                    if downloaded:
+                        logger.info('Genome data successfully downloaded for {}'.format(genome_obj.original_id))
+                        for genome_record in records:
+                            genome_record['resolved_id'] = genome_obj.resolved_id
+                    else:
+                        logger.warning('Failed to download antiSMASH data for genome ID {} ({})'.format(genome_obj.resolved_id, genome_obj.original_id))
+
+                    # extract first in case the file turns out to be invalid
+                    self._extract_antismash_zip(genome_obj)
+
+                    with open(genome_status_file, 'a+', newline='\n') as f:
+                        f.write(genome_obj.to_csv()+'\n')
 
         missing = len([x for x in genome_status.values() if len(x.filename) == 0])
         logger.info('Dataset has {} missing sets of antiSMASH data (from a total of {})'.format(missing, len(genome_records)))
 
-        with open(genome_status_file, 'w', newline='\n') as f:
-            for obj in genome_status.values():
-                f.write(obj.to_csv()+'\n')
-
         if missing == len(genome_records):
             logger.warning('Failed to successfully retrieve ANY genome data!')
 
+    def _process_genome_record(self, genome_obj, genome_record, genome_status_file, status_lock):
+        # this is called from multiple threads, only the status file is shared between them
+        logger.info('Beginning lookup process for genome ID {}'.format(genome_obj.original_id))
+
+        try:
+            genome_obj.resolved_id = self._resolve_genome_id_data(genome_record['genome_ID'])
+        except ThrottledLookupError as e:
+            # don't record this as a failure, so the lookup is tried again next time
+            logger.warning('Lookup for genome ID {} was throttled, skipping it for now ({})'.format(genome_obj.original_id, e))
+            return False
+        except httpx.TransportError as te:
+            # same for connection problems, which shouldn't abort the other lookups either
+            logger.warning('Lookup for genome ID {} failed with a connection error, skipping it for now ({})'.format(genome_obj.original_id, te))
+            return False
+
+        genome_obj.attempted = True
+
+        if genome_obj.resolved_id is None:
+            # give up on this one
+            logger.warning('Failed lookup for genome ID {}'.format(genome_obj.original_id))
+            with status_lock:
+                with open(genome_status_file, 'a+') as f:
+                    f.write(genome_obj.to_csv()+'\n')
+            return False
+
+        return True
+
     def _download_mibig_json(self, version='1.4'):
         output_path = os.path.join(self.project_file_cache, 'mibig_json')
 
-        download_and_extract_mibig_json(self.project_download_cache, output_path, version)
+        download_and_extract_mibig_json(self.project_download_cache, output_path, version, self._client)
 
         open(os.path.join(output_path, 'completed'), 'w').close()
 
         return True
 
-    def _get_antismash_db_page(self, genome_obj):
+    async def _download_antismash_zips(self, antismash_objs):
+        # the antiSMASH lookups are dominated by network latency, so run a limited
+        # number of them at once over a shared connection pool
+        sem = asyncio.Semaphore(ANTISMASH_DOWNLOAD_CONCURRENCY)
+        limits = httpx.Limits(max_connections=ANTISMASH_MAX_CONNECTIONS)
+
+        async with httpx.AsyncClient(headers=HTTP_CLIENT_HEADERS, timeout=HTTP_CLIENT_TIMEOUT, http2=HTTP_CLIENT_HTTP2, limits=limits) as client:
+            async def sem_wrap(antismash_obj):
+                async with sem:
+                    try:
+                        return await self._download_antismash_zip(client, antismash_obj)
+                    except Exception as e:
+                        logger.warning('antiSMASH download failed for {}: {}'.format(antismash_obj.resolved_id, e))
+                        return False
+
+            return await asyncio.gather(*(sem_wrap(antismash_obj) for antismash_obj in antismash_objs))
+
+    async def _async_get(self, client, url):
+        for attempt in range(HTTP_RETRY_ATTEMPTS):
+            resp = await client.get(url)
+            if resp.status_code != httpx.codes.TOO_MANY_REQUESTS:
+                break
+
+            delay = _retry_after(resp)
+            logger.debug('Request for {} was throttled, trying again in {} seconds'.format(url, delay))
+            await asyncio.sleep(delay)
+
+        return resp
+
+    async def _get_antismash_db_page(self, client, genome_obj):
         # want to try up to 4 different links here, v1 and v2 databases, each
         # with and without the .1 suffix on the accesssion ID
 
@@ -457,49 +849,81 @@ class Downloader(object):
 
                 logger.info('antismash DB lookup for {} => {}'.format(accession, url))
                 try:
-                    resp = httpx.get(url)
-                    soup = BeautifulSoup(resp.content, 'html.parser')
-                    # retrieve .zip file download link
-                    link = soup.find('a', {'href': lambda url: url.endswith('.zip')})
+                    resp = await self._async_get(client, url)
+                    root = lxmlhtml.fromstring(resp.content)
+                    # retrieve .zip file download link (XPath 1.0 has no ends-with)
+                    links = root.xpath('//a[substring(@href, string-length(@href) - 3) = ".zip"]/@href')
+                    if len(links) > 0:
+                        link = links[0]
                 except Exception as e:
                     logger.debug('antiSMASH DB page load failed: {}'.format(e))
 
                 if link is not None:
-                    logger.info('antiSMASH lookup succeeded! Filename is {}'.format(link['href']))
+                    logger.info('antiSMASH lookup succeeded! Filename is {}'.format(link))
                     # save with the .1 suffix if that worked
                     genome_obj.resolved_id = accession
-                    return link['href']
+                    return link
 
         return None
 
-    def _get_antismash_zip_data(self, accession_id, filename, local_path):
-        for base_url in [ANTISMASH_DB_DOWNLOAD_URL, ANTISMASH_DBV2_DOWNLOAD_URL]:
+    async def _get_antismash_zip_data(self, client, accession_id, filename, local_path):
+        # download to a .part file first so an interrupted download can be resumed.
+        # each database gets its own .part file, since resuming a download with
+        # data from the other one would produce a corrupted file
+        part_paths = [local_path + '.part', local_path + '.v2.part']
+        for base_url, part_path in zip([ANTISMASH_DB_DOWNLOAD_URL, ANTISMASH_DBV2_DOWNLOAD_URL], part_paths):
             zipfile_url = base_url.format(accession_id, filename)
-            with open(local_path, 'wb') as f:
-                total_bytes = 0
-                try: 
-                    with httpx.stream('GET', zipfile_url) as r:
+            total_bytes = 0
+            try: 
+                for attempt in range(HTTP_RETRY_ATTEMPTS):
+                    have, headers = _range_request(part_path)
+                    async with client.stream('GET', zipfile_url, headers=headers) as r:
+                        if r.status_code == httpx.codes.TOO_MANY_REQUESTS:
+                            delay = _retry_after(r)
+                            logger.debug('antiSMASH download was throttled, trying again in {} seconds'.format(delay))
+                            await asyncio.sleep(delay)
+                            continue
+
                         if r.status_code == 404:
                             logger.debug('antiSMASH download URL was a 404')
-                            continue
+                            break
+
+                        offset = _resume_offset(r, part_path, have)
+                        if offset is None:
+                            logger.info('antiSMASH data was already fully downloaded: {}'.format(zipfile_url))
+                            total_bytes = have
+                            break
+                        total_bytes = offset
+
+                        # several of these can be running at the same time so
+                        # log progress instead of drawing a progress bar
+                        if offset > 0:
+                            logger.info('Resuming download from antiSMASH at byte {}: {}'.format(offset, zipfile_url))
+                        else:
+                            logger.info('Downloading from antiSMASH: {}'.format(zipfile_url))
+                        with open(part_path, 'ab' if offset > 0 else 'wb') as f:
+                            async for data in r.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                                f.write(data)
+                                total_bytes += len(data)
+                        logger.info('Downloaded {} ({} bytes)'.format(filename, total_bytes))
+                        break
+            except Exception as e:
+                logger.warning('antiSMASH zip download failed: {}'.format(e))
+                continue
 
-                        logger.info('Downloading from antiSMASH: {}'.format(zipfile_url))
-                        filesize = int(r.headers['content-length'])
-                        bar = Bar(filename, max=filesize, suffix='%(percent)d%%')
-                        for data in r.iter_bytes():
-                            f.write(data)
-                            total_bytes += len(data)
-                            bar.next(len(data))
-                        bar.finish()
-                except Exception as e:
-                    logger.warning('antiSMASH zip download failed: {}'.format(e))
-                    continue
-        
+            if total_bytes == 0:
+                continue
+
+            os.replace(part_path, local_path)
+            # remove any leftover data from the other database
+            for other_path in part_paths:
+                if os.path.exists(other_path):
+                    os.unlink(other_path)
             return True
 
         return False
     
-    def _download_antismash_zip(self, antismash_obj):
+    async def _download_antismash_zip(self, client, antismash_obj):
         # save zip files to avoid having to repeat above lookup every time
         local_path = os.path.join(self.project_download_cache, '{}.zip'.format(antismash_obj.resolved_id))
         logger.debug('Checking for existing antismash zip at {}'.format(local_path))
@@ -520,11 +944,12 @@ class Downloader(object):
                 antismash_obj.filename = ""
 
         if not cached:
-            filename = self._get_antismash_db_page(antismash_obj)
+            filename = await self._get_antismash_db_page(client, antismash_obj)
             if filename is None:
                 return False
 
-            self._get_antismash_zip_data(antismash_obj.resolved_id, filename, local_path)    
+            if not await self._get_antismash_zip_data(client, antismash_obj.resolved_id, filename, local_path):
+                return False
             antismash_obj.filename = local_path
 
         return True
@@ -545,16 +970,41 @@ class Downloader(object):
         if not os.path.exists(output_path):
             os.makedirs(output_path, exist_ok=True)
 
-        antismash_zip = zipfile.ZipFile(antismash_obj.filename)
+        try:
+            antismash_zip = zipfile.ZipFile(antismash_obj.filename)
+        except zipfile.BadZipFile as bzf:
+            # delete it and mark it as not attempted so it's downloaded again next time
+            logger.warning('Invalid antismash zipfile {} ({}), removing it'.format(antismash_obj.filename, bzf))
+            os.unlink(antismash_obj.filename)
+            antismash_obj.filename = ""
+            antismash_obj.attempted = False
+            return False
+
         kc_prefix1 = '{}/knownclusterblast'.format(antismash_obj.resolved_id)
         kc_prefix2 = 'knownclusterblast'
+        members = []
         for zip_member in antismash_zip.namelist():
             # TODO other files here?
             if zip_member.endswith('.gbk') or zip_member.endswith('.json'):
-                antismash_zip.extract(zip_member, path=output_path)
+                members.append(zip_member)
             elif zip_member.startswith(kc_prefix1) or zip_member.startswith(kc_prefix2):
                 if zip_member.endswith('.txt') and 'mibig_hits' not in zip_member:
-                    antismash_zip.extract(zip_member, path=output_path)
+                    members.append(zip_member)
+        antismash_zip.close()
+
+        # there can be hundreds of .gbk files in each archive, so split the extraction
+        # between several threads (zlib releases the GIL while decompressing). ZipFile.extract
+        # isn't safe to call concurrently when it has to create directories, so do that first
+        for member_dir in set(os.path.dirname(m) for m in members):
+            if len(member_dir) > 0:
+                os.makedirs(os.path.join(output_path, member_dir), exist_ok=True)
+
+        num_workers = max(1, min(len(members), os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=num_workers) as ex:
+            futures = [ex.submit(_extract_zip_members, antismash_obj.filename, members[i::num_workers], output_path) for i in range(num_workers)]
+            # raise any exceptions from the worker threads here
+            for future in futures:
+                future.result()
 
         open(os.path.join(output_path, 'completed'), 'w').close()
 
@@ -636,17 +1086,19 @@ class Downloader(object):
                 # note that this requires a POST, not a GET
                 total_bytes, last_total = 0, 0
                 spinner = Spinner('Downloading metabolomics data... ')
-                with httpx.stream('POST', url) as r:
-                    for data in r.iter_bytes():
+                with self._client.stream('POST', url) as r:
+                    for data in r.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
                         f.write(data)
                         total_bytes += len(data)
-                        spinner.next()
+                        if total_bytes - last_total >= PROGRESS_UPDATE_BYTES:
+                            spinner.next()
+                            last_total = total_bytes
                 spinner.finish()
 
-        logger.info('Downloaded metabolomics data!')
+            # this should throw an exception if zip is malformed etc
+            mbzip = zipfile.ZipFile(self.metabolomics_zip)
 
-        # this should throw an exception if zip is malformed etc
-        mbzip = zipfile.ZipFile(self.metabolomics_zip)
+        logger.info('Downloaded metabolomics data!')
 
         logger.info('Extracting files to {}'.format(self.project_file_cache))
         # extract the contents to the file cache folder. only want some of the files
@@ -657,26 +1109,66 @@ class Downloader(object):
         # - root/quantification_table*
         # - root/metadata_table*
         # - root/DB_result*
-        for member in mbzip.namelist():
-            if member.startswith('clusterinfosummarygroup_attributes_withIDs_withcomponentID')\
-                or member.startswith('networkedges_selfloop')\
-                or member.startswith('quantification_table')\
-                or member.startswith('metadata_table')\
-                or member.startswith('DB_result')\
-                or member.startswith('result_specnets_DB'):
-                    mbzip.extract(member, path=self.project_file_cache)
-            # move the MGF file to a /spectra subdirectory to better fit expected structure
-            elif member.endswith('.mgf'):
-                os.makedirs(os.path.join(self.project_file_cache, 'spectra'), exist_ok=True)
-                mbzip.extract(member, path=os.path.join(self.project_file_cache, 'spectra'))
+        members, mgf_members = [], []
+        for member in mbzip.infolist():
+            if member.filename.startswith(GNPS_ZIP_MEMBER_PREFIXES):
+                members.append(member)
+            elif member.filename.endswith('.mgf'):
+                mgf_members.append(member)
+
+        mbzip.extractall(path=self.project_file_cache, members=members)
+
+        # move the MGF file to a /spectra subdirectory to better fit expected structure
+        if len(mgf_members) > 0:
+            spectra_path = os.path.join(self.project_file_cache, 'spectra')
+            os.makedirs(spectra_path, exist_ok=True)
+            mbzip.extractall(path=spectra_path, members=mgf_members)
                         
         if self._is_new_gnps_format(self.project_file_cache):
             logger.info('Found NEW GNPS structure')
         else:
             logger.info('Found OLD GNPS structure')
 
+    def _load_project_index(self, all_project_json_file, index_file):
+        # returns a dict mapping MassIVE IDs to pairedomics IDs. building this means
+        # parsing the whole list of projects, so it's cached alongside the JSON file
+        # and only rebuilt when a new copy of that has been downloaded
+        if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(all_project_json_file):
+            try:
+                with open(index_file, 'rb') as f:
+                    return pickle.load(f)
+            except Exception as e:
+                logger.warning('Failed to load project index {} ({}), will recreate it'.format(index_file, e))
+
+        # the list of all projects can be large, so parse it incrementally and
+        # only keep the IDs
+        project_index = {}
+        with open(all_project_json_file, 'rb') as f:
+            for project in ijson.items(f, 'data.item'):
+                project_index.setdefault(project['metabolite_id'], project['_id'])
+
+        logger.debug('Saving index of {} projects to {}'.format(len(project_index), index_file))
+        with open(index_file, 'wb') as f:
+            pickle.dump(project_index, f)
+
+        return project_index
+
+    def _download_platform_file(self, url, local_path):
+        # save the response directly to disk without parsing it
+        part_path = local_path + '.part'
+        with self._client.stream('GET', url) as r:
+            if not r.status_code == 200:
+                raise Exception('Failed to download {} (status code {})'.format(url, r.status_code))
+
+            with open(part_path, 'wb') as f:
+                for data in r.iter_bytes():
+                    f.write(data)
+
+        os.replace(part_path, local_path)
+        logger.debug('Downloaded {} to {}'.format(url, local_path))
+
     def _download_platform_json_to_file(self, url, local_path):
-        resp = httpx.get(url)
+        resp = self._client.get(url)
         if not resp.status_code == 200:
             raise Exception('Failed to download {} (status code {})'.format(url, resp.status_code))
 
@@ -692,5 +1184,6 @@ if __name__ == "__main__":
     # salinispora dataset 
     # d = Downloader('MSV000079284')
 
-    d = Downloader('MSV000078836').get(False, "")
+    with Downloader('MSV000078836') as d:
+        d.get(False, "")
     # d = Downloader('MSV000079284').get(False, "")
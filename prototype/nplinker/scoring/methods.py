@@ -13,12 +13,20 @@
 # limitations under the License.
 
 
-import itertools
 import random
 import os
+from collections import defaultdict
 
 import numpy as np
 
+# numba is optional here, if it's not available the standardised Metcalf scores
+# are calculated using plain numpy instead
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 from .data_linking import DataLinks, LinkFinder
 from ..genomics import BGC, GCF
 from ..metabolomics import Spectrum, MolecularFamily
@@ -30,6 +38,34 @@ logger = LogConfig.getLogger(__file__)
 
 # TODO update/expand comments in this file!
 
+# used to distinguish missing entries from ones containing None values
+_MISSING = object()
+
+# enumeration for accessing results of LinkFinder.get_links, which are (3, num_links) arrays:
+# - R_SRC_ID: the ID of an object that was supplied as input to get_links
+# - R_DST_ID: the ID of an object that was discovered to have a link to an input object
+# - R_SCORE: the score for the link between a pair of objects
+R_SRC_ID, R_DST_ID, R_SCORE = range(3)
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, parallel=True)
+    def _metcalf_standardise_kernel(met_ids, gen_ids, scores, met_strain_counts, gen_strain_counts, expected, variance_sqrt):
+        # compiled equivalent of the numpy code in MetcalfScoring._metcalf_standardise
+        final_scores = np.empty(scores.shape[0])
+        for i in prange(scores.shape[0]):
+            met_strains = met_strain_counts[met_ids[i]]
+            gen_strains = gen_strain_counts[gen_ids[i]]
+            final_scores[i] = (scores[i] - expected[met_strains, gen_strains]) / variance_sqrt[met_strains, gen_strains]
+        return final_scores
+
+def _object_array(items):
+    # np.array would try to treat any sequence-like objects as nested sequences,
+    # so have to fill in an object array manually
+    arr = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        arr[i] = item
+    return arr
+
 class LinkCollection(object):
     """
     Class which stores the results of running one or more scoring methods. 
@@ -39,13 +75,78 @@ class LinkCollection(object):
     produced by the scoring method(s) about each link. 
 
     There are also some useful utility methods to filter the original results. 
+
+    By default the links are stored in a dict of dicts ({source: {target: ObjectLink}}).
+    For very large collections this has a lot of overhead, so if compact=True
+    the links are instead stored in a CSR-like layout: a list of sources, and 
+    flat arrays of targets and ObjectLinks where the entries for source i are
+    found at [indptr[i]:indptr[i+1]]. Results from further methods are merged 
+    directly into these arrays. The same API is available in both modes,
+    but in compact mode the .links property returns a copy of the data in 
+    the dict of dicts format.
     """
 
-    def __init__(self, and_mode=True):
+    def __init__(self, and_mode=True, compact=False):
         self._methods = set()
         self._link_data = {}
         self._targets = {}
         self._and_mode = and_mode
+        self._compact = compact
+
+        # used in compact mode only
+        self._sources = []
+        self._source_index = {}
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._link_targets = _object_array([])
+        self._link_objs = _object_array([])
+
+    def _pack(self, link_data):
+        # convert a dict of dicts to the compact layout 
+        self._sources = list(link_data.keys())
+        self._source_index = {source: i for i, source in enumerate(self._sources)}
+        self._indptr = np.concatenate(([0], np.cumsum([len(links) for links in link_data.values()], dtype=np.int64)))
+        self._link_targets = _object_array([target for links in link_data.values() for target in links.keys()])
+        self._link_objs = _object_array([link for links in link_data.values() for link in links.values()])
+
+    def _unpack(self):
+        # convert the compact layout back to a dict of dicts
+        return {source: self._source_links(source) for source in self._sources}
+
+    def _source_links(self, source):
+        # returns the {target: ObjectLink} dict for a single source
+        if not self._compact:
+            return self._link_data[source]
+
+        i = self._source_index[source]
+        start, end = self._indptr[i], self._indptr[i + 1]
+        return dict(zip(self._link_targets[start:end].tolist(), self._link_objs[start:end].tolist()))
+
+    def _compact_mask(self, callable_obj, values, sources):
+        # applies callable_obj to the values associated with each link (either
+        # the targets or the ObjectLinks themselves), returning a boolean mask. 
+        # if a list of sources is given, links from any other sources are kept 
+        if sources is None:
+            return np.fromiter((callable_obj(v) for v in values), dtype=bool, count=len(values))
+
+        source_mask = np.zeros(len(self._sources), dtype=bool)
+        source_mask[[self._source_index[source] for source in sources]] = True
+        mask = np.ones(len(values), dtype=bool)
+        for i in np.flatnonzero(np.repeat(source_mask, np.diff(self._indptr))):
+            mask[i] = callable_obj(values[i])
+        return mask
+
+    def _compact_filter(self, mask):
+        # removes the links not selected by mask, along with any sources 
+        # which no longer have any links
+        source_ids = np.repeat(np.arange(len(self._sources)), np.diff(self._indptr))
+        counts = np.bincount(source_ids[mask], minlength=len(self._sources))
+        keep = counts > 0
+
+        self._sources = [source for source, k in zip(self._sources, keep.tolist()) if k]
+        self._source_index = {source: i for i, source in enumerate(self._sources)}
+        self._indptr = np.concatenate(([0], np.cumsum(counts[keep], dtype=np.int64)))
+        self._link_targets = self._link_targets[mask]
+        self._link_objs = self._link_objs[mask]
 
     def _add_links_from_method(self, method, object_links):
         if method in self._methods:
@@ -55,7 +156,10 @@ class LinkCollection(object):
         # if this is the first set of results to be generated, can just dump
         # them all straight in
         if len(self._methods) == 0:
-            self._link_data = {k: v for k, v in object_links.items()}
+            if self._compact:
+                self._pack(object_links)
+            else:
+                self._link_data = {k: v for k, v in object_links.items()}
         else:
             # if already some results added, in OR mode can just merge the new set
             # with the existing set, but in AND mode need to ensure we end up with
@@ -63,10 +167,16 @@ class LinkCollection(object):
             
             if not self._and_mode:
                 logger.debug('Merging {} results from method {} in OR mode'.format(len(object_links), method.name))
-                self._merge_or_mode(object_links)
+                if self._compact:
+                    self._compact_merge_or_mode(object_links)
+                else:
+                    self._merge_or_mode(object_links)
             else:
                 logger.debug('Merging {} results from method {} in AND mode'.format(len(object_links), method.name))
-                self._merge_and_mode(object_links)
+                if self._compact:
+                    self._compact_merge_and_mode(object_links)
+                else:
+                    self._merge_and_mode(object_links)
 
         self._methods.add(method)
 
@@ -84,63 +194,151 @@ class LinkCollection(object):
                 continue
 
             links_to_merge = object_links[source]
-            intersect2 = existing_links.keys() & links_to_merge.keys()
+            # keep only the common links, merging in the new data as we go. iterate
+            # over the existing links (rather than a set intersection) so targets
+            # stay in their original order
+            common_links = {target: link._merge(links_to_merge[target]) for target, link in existing_links.items() if target in links_to_merge}
 
-            self._link_data[source] = {k: v for k, v in existing_links.items() if k in intersect2}
-
-            for target, object_link in object_links[source].items():
-                if target in self._link_data[source]:
-                    self._link_data[source][target]._merge(object_link)
-
-            if len(self._link_data[source]) == 0:
+            if len(common_links) == 0:
                 to_remove.add(source)
+                continue
+
+            self._link_data[source] = common_links
 
         for source in to_remove:
             del self._link_data[source]
 
+    def _compact_merge_and_mode(self, object_links):
+        # equivalent of _merge_and_mode working directly on the compact layout: 
+        # merge the new data into the common links, then drop all the others
+        mask = np.zeros(len(self._link_objs), dtype=bool)
+        for i, source in enumerate(self._sources):
+            links_to_merge = object_links.get(source)
+            if links_to_merge is None:
+                continue
+
+            start = self._indptr[i]
+            for j, target in enumerate(self._link_targets[start:self._indptr[i + 1]].tolist()):
+                new_link = links_to_merge.get(target)
+                if new_link is not None:
+                    self._link_objs[start + j]._merge(new_link)
+                    mask[start + j] = True
+
+        self._compact_filter(mask)
+
+    def _compact_merge_or_mode(self, object_links):
+        # equivalent of _merge_or_mode working directly on the compact layout. 
+        # the arrays are rebuilt from per-source chunks, where sources without 
+        # any new links just reuse slices of the existing arrays
+        target_chunks, link_chunks, counts = [], [], []
+        for i, source in enumerate(self._sources):
+            start, end = self._indptr[i], self._indptr[i + 1]
+            targets, links = self._link_targets[start:end], self._link_objs[start:end]
+            target_chunks.append(targets)
+            link_chunks.append(links)
+
+            new_links = object_links.get(source)
+            if new_links is None:
+                counts.append(end - start)
+                continue
+
+            # merge the links common to both, and append any new ones
+            existing = dict(zip(targets.tolist(), links.tolist()))
+            extra = [(target, object_link) for target, object_link in new_links.items() if target not in existing]
+            for target, object_link in new_links.items():
+                existing_link = existing.get(target)
+                if existing_link is not None:
+                    existing_link._merge(object_link)
+
+            if len(extra) > 0:
+                target_chunks.append(_object_array([target for target, _ in extra]))
+                link_chunks.append(_object_array([object_link for _, object_link in extra]))
+            counts.append(end - start + len(extra))
+
+        # finally add the sources which only appear in the new results
+        for source, links in object_links.items():
+            if source in self._source_index:
+                continue
+            self._sources.append(source)
+            target_chunks.append(_object_array(list(links.keys())))
+            link_chunks.append(_object_array(list(links.values())))
+            counts.append(len(links))
+
+        self._source_index = {source: i for i, source in enumerate(self._sources)}
+        self._indptr = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+        if len(target_chunks) > 0:
+            self._link_targets = np.concatenate(target_chunks)
+            self._link_objs = np.concatenate(link_chunks)
+
     def _merge_or_mode(self, object_links):
         # source = GCF/Spectrum, links = {Spectrum/GCF: ObjectLink} dict
         for source, links in object_links.items():
-
-            # update the existing dict with the new entries that don't appear in it already
-            if source not in self._link_data:
+            existing_links = self._link_data.get(source)
+            if existing_links is None:
                 self._link_data[source] = links
-            else:
-                self._link_data[source].update({k: v for k, v in links.items() if k not in self._link_data[source]})
+                continue
 
-            # now merge the remainder (common to both)
+            # add the new entries that don't appear in the existing dict already,
+            # and merge the ones common to both
             for target, object_link in links.items():
-                self._link_data[source][target]._merge(object_link)
+                existing_link = existing_links.get(target)
+                if existing_link is None:
+                    existing_links[target] = object_link
+                else:
+                    existing_link._merge(object_link)
 
     def filter_no_shared_strains(self):
-        len_before = len(self._link_data)
+        len_before = len(self)
         self.filter_links(lambda x: len(x.shared_strains) > 0)
-        logger.debug('filter_no_shared_strains: {} => {}'.format(len_before, len(self._link_data)))
+        logger.debug('filter_no_shared_strains: {} => {}'.format(len_before, len(self)))
+
+    # the filter methods delete entries in place rather than rebuilding the dicts, 
+    # since typically they will only be removing a small fraction of the links
 
     def filter_sources(self, callable_obj):
+        if self._compact:
+            len_before = len(self._sources)
+            source_mask = np.fromiter((callable_obj(source) for source in self._sources), dtype=bool, count=len(self._sources))
+            self._compact_filter(np.repeat(source_mask, np.diff(self._indptr)))
+            logger.debug('filter_sources: {} => {}'.format(len_before, len(self._sources)))
+            return
+
         len_before = len(self._link_data)
-        self._link_data = {k: v for k, v in self._link_data.items() if callable_obj(k)}
+        for source in [k for k in self._link_data.keys() if not callable_obj(k)]:
+            del self._link_data[source]
         logger.debug('filter_sources: {} => {}'.format(len_before, len(self._link_data)))
 
     def filter_targets(self, callable_obj, sources=None):
+        if self._compact:
+            self._compact_filter(self._compact_mask(callable_obj, self._link_targets, sources))
+            return
+
         to_remove = []
-        sources_list = self._link_data.keys() if sources is None else sources
+        sources_list = list(self._link_data.keys()) if sources is None else sources
         for source in sources_list:
-            self._link_data[source] = {k: v for k, v in self._link_data[source].items() if callable_obj(k)}
+            links = self._link_data[source]
+            for target in [k for k in links.keys() if not callable_obj(k)]:
+                del links[target]
             # if there are now no links for this source, remove it completely
-            if len(self._link_data[source]) == 0:
+            if len(links) == 0:
                 to_remove.append(source)
 
         for source in to_remove:
             del self._link_data[source]
 
     def filter_links(self, callable_obj, sources=None):
+        if self._compact:
+            self._compact_filter(self._compact_mask(callable_obj, self._link_objs, sources))
+            return
+
         to_remove = []
-        sources_list = self._link_data.keys() if sources is None else sources
+        sources_list = list(self._link_data.keys()) if sources is None else sources
         for source in sources_list:
-            self._link_data[source] = {k: v for k, v in self._link_data[source].items() if callable_obj(v)}
+            links = self._link_data[source]
+            for target in [k for k, v in links.items() if not callable_obj(v)]:
+                del links[target]
             # if there are now no links for this source, remove it completely
-            if len(self._link_data[source]) == 0:
+            if len(links) == 0:
                 to_remove.append(source)
 
         for source in to_remove:
@@ -158,17 +356,25 @@ class LinkCollection(object):
         # set to False, it will return a list consisting of the sorted links for
         # the given method, with any remaining links appended in arbitrary order.
 
+        links = self._source_links(source)
+
         # run <method>.sort on the links found by that method
-        sorted_links_for_method = method.sort([link for link in self._link_data[source].values() if method in link.methods], reverse)
+        sorted_links_for_method = method.sort([link for link in links.values() if method in link.methods], reverse)
 
         if not strict:
             # append any remaining links 
-            sorted_links_for_method.extend([link for link in self._link_data[source].values() if method not in link.methods])
+            sorted_links_for_method.extend([link for link in links.values() if method not in link.methods])
 
         return sorted_links_for_method
 
     def get_all_targets(self):
-        return list(set(itertools.chain.from_iterable(self._link_data[x].keys() for x in self._link_data.keys())))
+        if self._compact:
+            return list(set(self._link_targets.tolist()))
+
+        targets = set()
+        for links in self._link_data.values():
+            targets.update(links)
+        return list(targets)
 
     @property
     def methods(self):
@@ -177,21 +383,35 @@ class LinkCollection(object):
     @property
     def sources(self):
         # the set of objects supplied as input, which have links 
+        if self._compact:
+            return list(self._sources)
         return list(self._link_data.keys())
 
     @property
     def links(self):
+        """
+        The links as a dict of dicts ({source: {target: ObjectLink}}).
+
+        In compact mode this is a new dict built from the compact layout on
+        each access, so any changes made to it (adding/removing sources or
+        targets) are NOT reflected in the collection. Use the filter_* methods
+        to modify the collection instead.
+        """
+        if self._compact:
+            return self._unpack()
         return self._link_data
 
     @property
     def source_count(self):
-        return len(self._link_data)
+        return len(self)
 
     @property
     def method_count(self):
         return len(self._methods)
 
     def __len__(self):
+        if self._compact:
+            return len(self._sources)
         return len(self._link_data)
 
 class ObjectLink(object):
@@ -236,14 +456,20 @@ class ObjectLink(object):
         return self._method_data[method]
 
     def __getitem__(self, name):
-        if name in self._method_data:
-            return self._method_data[name]
+        data = self._method_data.get(name, _MISSING)
+        if data is not _MISSING:
+            return data
 
-        return object.__getitem__(self, name)
+        raise KeyError(name)
 
     def __hash__(self):
-        # return the nplinker internal ID as hash value (for set/dict etc)
-        return self.source.id
+        # there is at most one ObjectLink per (source, target) pair, so combine 
+        # the identities of those. using the source ID on its own meant that links
+        # from e.g. a GCF and a Spectrum with the same ID would collide
+        return id(self.source) ^ (id(self.target) << 1)
+
+    def __eq__(self, other):
+        return self is other
 
     def __str__(self):
         return 'ObjectLink(source={}, target={}, #methods={})'.format(self.source, self.target, len(self._method_data))
@@ -323,6 +549,10 @@ class RosettaScoring(ScoringMethod):
         self.spec_score_cutoff = 0.0
         self.bgc_score_cutoff = 0.0
 
+        # filtered + grouped hits for the most recent set of cutoff values that
+        # get_links was called with, ((spec_cutoff, bgc_cutoff), all_hits, by_bgc_id, by_spec_id)
+        self._hits_cache = None
+
     @staticmethod
     def setup(npl):
         logger.info('RosettaScoring setup')
@@ -344,15 +574,35 @@ class RosettaScoring(ScoringMethod):
         RosettaScoring.ROSETTA_OBJ.run(npl.spectra, npl.bgcs, ms1_tol, ms2_tol, score_thresh, min_match_peaks)
         logger.info('RosettaScoring setup completed')
 
-    def _include_hit(self, hit):
-        if hit.spec_match_score < self.spec_score_cutoff or hit.bgc_match_score < self.bgc_score_cutoff:
-            return False
-
-        return True
+    def _get_hits(self):
+        # the set of hits only changes if the cutoffs do (or if setup is run again),
+        # so only need to redo this filtering when one of those changes. only the
+        # most recent result is kept, since arbitrary float cutoffs would otherwise
+        # make the cache grow without limit
+        all_hits = RosettaScoring.ROSETTA_OBJ._rosetta_hits
+        spec_score_cutoff, bgc_score_cutoff = self.spec_score_cutoff, self.bgc_score_cutoff
+        cached = self._hits_cache
+        if cached is not None and cached[0] == (spec_score_cutoff, bgc_score_cutoff) and cached[1] is all_hits:
+            return cached[2], cached[3]
+
+        # group the RosettaHit objects which satisfy the current cutoffs by BGC and
+        # Spectrum IDs so that each input object only has to do a single lookup
+        # to find its hits
+        hits_by_bgc_id, hits_by_spec_id = defaultdict(list), defaultdict(list)
+        for hit in all_hits:
+            if hit.spec_match_score >= spec_score_cutoff and hit.bgc_match_score >= bgc_score_cutoff:
+                hits_by_bgc_id[hit.bgc.id].append(hit)
+                hits_by_spec_id[hit.spec.id].append(hit)
+
+        self._hits_cache = ((spec_score_cutoff, bgc_score_cutoff), all_hits, hits_by_bgc_id, hits_by_spec_id)
+        return hits_by_bgc_id, hits_by_spec_id
 
     def get_links(self, objects, link_collection):
         # enforce constraint that the list must contain a set of identically typed objects
-        if not all(isinstance(x, type(objects[0])) for x in objects):
+        # (checking the exact type first is much quicker in the common case, but still 
+        # need to allow for subclasses like SingletonFamily)
+        input_type = type(objects[0])
+        if any(type(x) is not input_type and not isinstance(x, input_type) for x in objects):
             raise Exception('RosettaScoring: uniformly-typed list of objects is required')
 
         if isinstance(objects[0], MolecularFamily):
@@ -360,46 +610,44 @@ class RosettaScoring(ScoringMethod):
 
         if isinstance(objects[0], GCF):
             # assume user wants to use all BGCs from these GCFs
-            bgcs = list(set(itertools.chain.from_iterable(x.bgcs for x in objects)))
+            bgc_set = set()
+            for gcf in objects:
+                bgc_set.update(gcf.bgcs)
+            bgcs = list(bgc_set)
             logger.info('RosettaScoring got {} GCFs input, converted to {} BGCs'.format(len(objects), len(bgcs)))
             objects = bgcs
 
-        # list of RosettaHit objects which satisfy the current cutoffs
-        ro_hits = list(filter(lambda hit: self._include_hit(hit), RosettaScoring.ROSETTA_OBJ._rosetta_hits))
+        hits_by_bgc_id, hits_by_spec_id = self._get_hits()
 
-        # TODO this might need to be faster
         results = {}
         if isinstance(objects[0], BGC):
             for bgc in objects:
-                for hit in ro_hits:
-                    if bgc.id == hit.bgc.id:
-                        src = bgc if not self.bgc_to_gcf else bgc.parent
-                        if src not in results:
-                            results[src] = {}
-
-                        # Rosetta can produce multiple "hits" per link, need to 
-                        # ensure the ObjectLink contains all the RosettaHit objects
-                        # in these cases
-                        if hit.spec in results[src]:
-                            original_data = results[src][hit.spec].data(self)
-                            results[src][hit.spec].set_data(self, original_data + [hit])
-                        else:
-                            results[src][hit.spec] = ObjectLink(src, hit.spec, self, data=[hit])
+                for hit in hits_by_bgc_id.get(bgc.id, ()):
+                    src = bgc if not self.bgc_to_gcf else bgc.parent
+                    src_links = results.setdefault(src, {})
+
+                    # Rosetta can produce multiple "hits" per link, need to 
+                    # ensure the ObjectLink contains all the RosettaHit objects
+                    # in these cases
+                    link = src_links.get(hit.spec)
+                    if link is None:
+                        src_links[hit.spec] = ObjectLink(src, hit.spec, self, data=[hit])
+                    else:
+                        link.data(self).append(hit)
         else: # Spectrum
             for spec in objects:
-                for hit in ro_hits:
-                    if spec.id == hit.spec.id:
-                        target = hit.bgc if not self.bgc_to_gcf else hit.bgc.parent
-                        if spec not in results:
-                            results[spec] = {}
-                        # Rosetta can produce multiple "hits" per link, need to 
-                        # ensure the ObjectLink contains all the RosettaHit objects
-                        # in these cases
-                        if target in results[spec]:
-                            original_data = results[spec][target].data(self)
-                            results[spec][target].set_data(self, original_data + [hit])
-                        else:
-                            results[spec][target] = ObjectLink(spec, target, self, data=[hit])
+                for hit in hits_by_spec_id.get(spec.id, ()):
+                    target = hit.bgc if not self.bgc_to_gcf else hit.bgc.parent
+                    spec_links = results.setdefault(spec, {})
+
+                    # Rosetta can produce multiple "hits" per link, need to 
+                    # ensure the ObjectLink contains all the RosettaHit objects
+                    # in these cases
+                    link = spec_links.get(target)
+                    if link is None:
+                        spec_links[target] = ObjectLink(spec, target, self, data=[hit])
+                    else:
+                        link.data(self).append(hit)
 
 
         link_collection._add_links_from_method(self, results)
@@ -420,11 +668,14 @@ class MetcalfScoring(ScoringMethod):
     LINKFINDER = None
     NAME = 'metcalf'
 
-    # enumeration for accessing results of LinkFinder.get_links, which are (3, num_links) arrays:
-    # - R_SRC_ID: the ID of an object that was supplied as input to get_links
-    # - R_DST_ID: the ID of an object that was discovered to have a link to an input object
-    # - R_SCORE: the score for the link between a pair of objects
-    R_SRC_ID, R_DST_ID, R_SCORE = range(3)
+    # number of strains for each Spectrum/MolFam/GCF, indexed by object ID. these
+    # are used when calculating standardised scores for every link
+    SPEC_STRAIN_COUNTS = None
+    MOLFAM_STRAIN_COUNTS = None
+    GCF_STRAIN_COUNTS = None
+
+    # see the module-level definitions
+    R_SRC_ID, R_DST_ID, R_SCORE = R_SRC_ID, R_DST_ID, R_SCORE
 
     def __init__(self, npl):
         super(MetcalfScoring, self).__init__(npl)
@@ -473,48 +724,61 @@ class MetcalfScoring(ScoringMethod):
             logger.debug('MetcalfScoring.setup caching results')
             save_pickled_data((dataset_counts, MetcalfScoring.DATALINKS, MetcalfScoring.LINKFINDER), cache_file)
 
+        # these are cheap to generate compared to the above, so just do it every time
+        MetcalfScoring.SPEC_STRAIN_COUNTS = MetcalfScoring._metcalf_strain_counts(npl.spectra)
+        MetcalfScoring.MOLFAM_STRAIN_COUNTS = MetcalfScoring._metcalf_strain_counts(npl.molfams)
+        MetcalfScoring.GCF_STRAIN_COUNTS = MetcalfScoring._metcalf_strain_counts(npl.gcfs)
+
         logger.info('MetcalfScoring.setup completed')
 
     @property
     def datalinks(self):
         return MetcalfScoring.DATALINKS
 
+    @staticmethod
+    def _metcalf_strain_counts(objs):
+        # met_obj will be either a Spectrum or a MolecularFamily, but doesn't 
+        # matter which (in this implementation at least) because they both have
+        # a .strains attribute which is the only thing we need. For Spectra 
+        # it's the number of strains, for a MolFam it's the total number of 
+        # *unique* strains across all Spectra in that family.
+        return np.fromiter((len(obj.strains) for obj in objs), dtype=np.int32, count=len(objs))
+
+    def _metcalf_standardise(self, linkfinder, result, met_strain_counts, gen_strain_counts, met_row, gen_row):
+        # calculates the standardised scores for all the links in a (3, x) result
+        # array at once. met_row/gen_row give the rows containing the IDs of the 
+        # metabolomic and genomic objects respectively
+        src_ids = result[R_SRC_ID].astype(np.intp)
+        dst_ids = result[R_DST_ID].astype(np.intp)
+        met_ids, gen_ids = (src_ids, dst_ids) if met_row == R_SRC_ID else (dst_ids, src_ids)
+
+        if NUMBA_AVAILABLE:
+            final_scores = _metcalf_standardise_kernel(met_ids, gen_ids, result[R_SCORE], met_strain_counts, gen_strain_counts, 
+                                                       linkfinder.metcalf_expected, linkfinder.metcalf_variance_sqrt)
+        else:
+            # lookup expected + variance values based on strain counts 
+            met_strains = met_strain_counts[met_ids]
+            gen_strains = gen_strain_counts[gen_ids]
+            expected = linkfinder.metcalf_expected[met_strains, gen_strains]
+            variance_sqrt = linkfinder.metcalf_variance_sqrt[met_strains, gen_strains]
+
+            # calculate the final scores based on the basic Metcalf scores for each 
+            # pair of objects
+            final_scores = (result[R_SCORE] - expected) / variance_sqrt
+
+        # finally apply the scoring cutoff (if any) with a single mask
+        mask = final_scores >= (self.cutoff if self.cutoff is not None else -np.inf)
+        return np.vstack([src_ids[mask], dst_ids[mask], final_scores[mask]])
+
     def _metcalf_postprocess_met(self, linkfinder, results, input_type):
         logger.debug('Postprocessing results for standardised Metcalf scores (met input)')
         # results will be links from EITHER Spectrum OR MolFam => GCF here
 
         # need to know if the metabolomic objects given as input are Spectrum/MolFam 
-        met_objs = self.npl.spectra if input_type == Spectrum else self.npl.molfams
-        new_src, new_dst, new_sco = [], [], []
-
-        # go through each pair of input objects and calculate their standardised scores
-        for i in range(len(results[0][self.R_SRC_ID])):
-            met_obj = met_objs[int(results[0][self.R_SRC_ID][i])]
-            # met_obj will now be either a Spectrum or a MolecularFamily, but 
-            # doesn't matter which (in this implementation at least) because they
-            # both have a .strains attribute which is the only thing we need. For
-            # Spectra it's the number of strains, for a MolFam it's the total
-            # number of *unique* strains across all Spectra in that family.
-            met_strains = len(met_obj.strains)
-            gcf = self.npl.gcfs[int(results[0][self.R_DST_ID][i])]
-            gen_strains = len(gcf.strains)
-
-            # lookup expected + variance values based on strain counts 
-            expected = linkfinder.metcalf_expected[met_strains][gen_strains]
-            variance_sqrt = linkfinder.metcalf_variance_sqrt[met_strains][gen_strains]
-
-            # calculate the final score based on the basic Metcalf score for these two
-            # particular objects
-            final_score = (results[0][self.R_SCORE][i] - expected) / variance_sqrt
-
-            # finally apply the scoring cutoff and store the result
-            if self.cutoff is None or (final_score >= self.cutoff):
-                new_src.append(int(results[0][self.R_SRC_ID][i]))
-                new_dst.append(int(results[0][self.R_DST_ID][i]))
-                new_sco.append(final_score)
+        met_strain_counts = MetcalfScoring.SPEC_STRAIN_COUNTS if input_type == Spectrum else MetcalfScoring.MOLFAM_STRAIN_COUNTS
 
         # overwrite original "results" with equivalent new data structure
-        return [np.array([new_src, new_dst, new_sco])]
+        return [self._metcalf_standardise(linkfinder, results[0], met_strain_counts, MetcalfScoring.GCF_STRAIN_COUNTS, R_SRC_ID, R_DST_ID)]
 
     def _metcalf_postprocess_gen(self, linkfinder, results, input_type):
         logger.debug('Postprocessing results for standardised Metcalf scores (gen input)')
@@ -522,47 +786,21 @@ class MetcalfScoring(ScoringMethod):
         # element Spectra, second MolFams)
 
         new_results = []
-        met_objs_list = [self.npl.spectra, self.npl.molfams]
+        met_strain_counts_list = [MetcalfScoring.SPEC_STRAIN_COUNTS, MetcalfScoring.MOLFAM_STRAIN_COUNTS]
 
         # iterate over the Spectrum results and then the MolFam results
-        for m, met_objs in enumerate(met_objs_list):
-            new_src, new_dst, new_sco = [], [], []
-
-            # go through each pair of input objects and calculate their standardised scores
-            for i in range(len(results[m][self.R_SRC_ID])):
-                gcf = self.npl.gcfs[int(results[m][self.R_SRC_ID][i])]
-                gen_strains = len(gcf.strains)
-
-                # met_obj will now be either a Spectrum or a MolecularFamily, but 
-                # doesn't matter which (in this implementation at least) because they
-                # both have a .strains attribute which is the only thing we need. For
-                # Spectra it's the number of strains, for a MolFam it's the total
-                # number of *unique* strains across all Spectra in that family.
-                met_obj = met_objs[int(results[m][self.R_DST_ID][i])]
-                met_strains = len(met_obj.strains)
-
-                # lookup expected + variance values based on strain counts 
-                expected = linkfinder.metcalf_expected[met_strains][gen_strains]
-                variance_sqrt = linkfinder.metcalf_variance_sqrt[met_strains][gen_strains]
-
-                # calculate the final score based on the basic Metcalf score for these two
-                # particular objects
-                final_score = (results[m][self.R_SCORE][i] - expected) / variance_sqrt
-
-                # finally apply the scoring cutoff and store the result
-                if self.cutoff is None or (final_score >= self.cutoff):
-                    new_src.append(int(results[m][self.R_SRC_ID][i]))
-                    new_dst.append(int(results[m][self.R_DST_ID][i]))
-                    new_sco.append(final_score)
-
+        for m, met_strain_counts in enumerate(met_strain_counts_list):
             # overwrite original "results" with equivalent new data structure
-            new_results.append(np.array([new_src, new_dst, new_sco]))
+            new_results.append(self._metcalf_standardise(linkfinder, results[m], met_strain_counts, MetcalfScoring.GCF_STRAIN_COUNTS, R_DST_ID, R_SRC_ID))
 
         return new_results
 
     def get_links(self, objects, link_collection):
         # enforce constraint that the list must contain a set of identically typed objects
-        if not all(isinstance(x, type(objects[0])) for x in objects):
+        # (checking the exact type first is much quicker in the common case, but still 
+        # need to allow for subclasses like SingletonFamily)
+        input_type = type(objects[0])
+        if any(type(x) is not input_type and not isinstance(x, input_type) for x in objects):
             raise Exception('MetcalfScoring: uniformly-typed list of objects is required')
 
         # also can't handle BGCs here, must be one of the other 3 types (GCF/Spectrum/MolecularFamily)
@@ -571,7 +809,6 @@ class MetcalfScoring(ScoringMethod):
 
         datalinks = MetcalfScoring.DATALINKS
         linkfinder = MetcalfScoring.LINKFINDER
-        input_type = type(objects[0])
 
         logger.debug('MetcalfScoring: standardised = {}'.format(self.standardised))
         if not self.standardised:
@@ -607,6 +844,7 @@ class MetcalfScoring(ScoringMethod):
             # for GCF input, results contains two arrays of shape (3, x), 
             # which contain spec-gcf and fam-gcf links respectively 
             result_gcf_spec, result_gcf_fam = results[0], results[1]
+            gcfs = self.npl._gcfs
 
             for res, type_ in [(result_gcf_spec, Spectrum), (result_gcf_fam, MolecularFamily)]:
                 if res.shape[1] == 0:
@@ -614,15 +852,19 @@ class MetcalfScoring(ScoringMethod):
                         logger.debug('Found no links for {} input objects (type {})'.format(len(objects), type_))
                     continue # no results
 
-                # for each entry in the results (each Spectrum or MolecularFamily)
-                for j in range(res.shape[1]):
-                    # extract the ID of the object and get the object itself
-                    obj_id = int(res[self.R_DST_ID, j])
-                    obj = self.npl._spectra[obj_id] if type_ == Spectrum else self.npl._molfams[obj_id]
+                # convert the results to lists of plain Python values in one go
+                # rather than extracting each individual element from the array
+                gcf_ids = res[R_SRC_ID].astype(np.intp).tolist()
+                obj_ids = res[R_DST_ID].astype(np.intp).tolist()
+                scores = res[R_SCORE].tolist()
+                objs = self.npl._spectra if type_ == Spectrum else self.npl._molfams
 
-                    # retrieve the GCF object too (can use its internal ID to index
-                    # directly into the .gcfs list)
-                    gcf = self.npl._gcfs[int(res[self.R_SRC_ID][j])]
+                # for each entry in the results (each Spectrum or MolecularFamily)
+                for gcf_id, obj_id, score in zip(gcf_ids, obj_ids, scores):
+                    # get the object itself and the GCF object too (can use their
+                    # internal IDs to index directly into the appropriate lists)
+                    obj = objs[obj_id]
+                    gcf = gcfs[gcf_id]
 
                     # record that this GCF has at least one link associated with it
                     scores_found.add(gcf)
@@ -630,7 +872,7 @@ class MetcalfScoring(ScoringMethod):
                     # save the scores
                     if gcf not in metcalf_results:
                         metcalf_results[gcf] = {}
-                    metcalf_results[gcf][obj] = ObjectLink(gcf, obj, self, res[self.R_SCORE, j])
+                    metcalf_results[gcf][obj] = ObjectLink(gcf, obj, self, score)
 
         else:
             logger.debug('MetcalfScoring: input_type=Spec/MolFam, result_type=GCF, inputs={}, results={}'.format(len(objects), results[0].shape))
@@ -644,15 +886,20 @@ class MetcalfScoring(ScoringMethod):
                 logger.debug('MetcalfScoring: completed')
                 return link_collection
 
-            # for each entry in the results (each GCF)
-            for j in range(results.shape[1]):
-                # extract the ID of the GCF and use that to get the object itself
-                gcf = self.npl._gcfs[int(results[self.R_DST_ID, j])]
+            # convert the results to lists of plain Python values in one go
+            # rather than extracting each individual element from the array
+            obj_ids = results[R_SRC_ID].astype(np.intp).tolist()
+            gcf_ids = results[R_DST_ID].astype(np.intp).tolist()
+            scores = results[R_SCORE].tolist()
+            gcfs = self.npl._gcfs
+            objs = self.npl._spectra if input_type == Spectrum else self.npl._molfams
 
-                # retrieve the Spec/MolFam object too (can use its internal ID to index
-                # directly into the appropriate list)
-                obj_id = int(results[self.R_SRC_ID, j])
-                obj = self.npl._spectra[obj_id] if input_type == Spectrum else self.npl._molfams[obj_id]
+            # for each entry in the results (each GCF)
+            for obj_id, gcf_id, score in zip(obj_ids, gcf_ids, scores):
+                # get the GCF and the Spec/MolFam objects (can use their internal IDs
+                # to index directly into the appropriate lists)
+                gcf = gcfs[gcf_id]
+                obj = objs[obj_id]
 
                 # record that this Spectrum or MolecularFamily has at least one link associated with it
                 scores_found.add(obj)
@@ -660,7 +907,7 @@ class MetcalfScoring(ScoringMethod):
                 # save the scores
                 if obj not in metcalf_results:
                     metcalf_results[obj] = {}
-                metcalf_results[obj][gcf] = ObjectLink(obj, gcf, self, results[self.R_SCORE, j])
+                metcalf_results[obj][gcf] = ObjectLink(obj, gcf, self, score)
 
         logger.debug('MetcalfScoring found {} results'.format(len(metcalf_results)))
         link_collection._add_links_from_method(self, metcalf_results)
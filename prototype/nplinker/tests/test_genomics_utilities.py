@@ -0,0 +1,88 @@
+# Copyright 2021 The NPLinker Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Tests for the cand_cluster SMILES lookup in genomics_utilities, using small
+# inline GenBank records
+
+from nplinker.genomics_utilities import _find_cand_cluster_smiles, get_smiles
+
+def gbk_record(features, name='REC1'):
+    # builds a minimal GenBank record from a list of feature table lines
+    lines = ['LOCUS       {}                  20 bp    DNA     linear   UNK 01-JAN-1980'.format(name),
+             'DEFINITION  test record.',
+             'FEATURES             Location/Qualifiers']
+    lines.extend(features)
+    lines.extend(['ORIGIN', '        1 acgtacgtac gtacgtacgt', '//'])
+    return '\n'.join(lines) + '\n'
+
+CDS = ['     CDS             1..20',
+       '                     /locus_tag="ctg1_1"',
+       '                     /translation="MKLV"']
+
+def cand_cluster(*qualifiers):
+    return ['     cand_cluster    1..20',
+            '                     /candidate_cluster_number="1"'] + ['                     {}'.format(q) for q in qualifiers]
+
+def find(text):
+    return _find_cand_cluster_smiles(text.splitlines(True))
+
+def test_no_cand_cluster():
+    assert find(gbk_record(CDS)) is None
+
+def test_single_line_smiles():
+    assert find(gbk_record(cand_cluster('/SMILES="CCO"') + CDS)) == 'CCO'
+
+def test_multi_line_smiles():
+    text = gbk_record(CDS + cand_cluster('/SMILES="NC(CC(=O)O)C(=O)NC(C',
+                                         'C(C)C)C(=O)O"',
+                                         '/tool="antismash"'))
+    assert find(text) == 'NC(CC(=O)O)C(=O)NC(C C(C)C)C(=O)O'
+
+def test_cand_cluster_without_smiles():
+    assert find(gbk_record(cand_cluster('/tool="antismash"') + CDS)) == ''
+
+def test_cand_cluster_in_later_record():
+    text = gbk_record(CDS, 'REC1') + gbk_record(cand_cluster('/SMILES="CCN"'), 'REC2')
+    assert find(text) == 'CCN'
+
+def test_cand_cluster_last_feature():
+    # with no SMILES qualifier, ORIGIN ends the feature
+    assert find(gbk_record(CDS + cand_cluster('/tool="antismash"'))) == ''
+    assert find(gbk_record(CDS + cand_cluster('/tool="antismash"', '/SMILES="CC"'))) == 'CC'
+
+def test_empty_smiles():
+    assert find(gbk_record(cand_cluster('/SMILES=""') + CDS)) == ''
+
+def test_only_first_cand_cluster_used():
+    text = gbk_record(cand_cluster('/tool="antismash"') + cand_cluster('/SMILES="CCO"'))
+    assert find(text) == ''
+
+class DummyBGC(object):
+    def __init__(self, antismash_file):
+        self.antismash_file = antismash_file
+
+def test_get_smiles(tmp_path):
+    def smiles_for(text):
+        path = tmp_path / 'test.gbk'
+        path.write_text(text)
+        return get_smiles(DummyBGC(str(path)))
+
+    assert smiles_for(gbk_record(CDS)) is None
+    assert smiles_for(gbk_record(cand_cluster('/SMILES=""'))) is None
+    assert smiles_for(gbk_record(cand_cluster('/tool="antismash"'))) is None
+    # spaces from joined continuation lines are removed
+    assert smiles_for(gbk_record(cand_cluster('/SMILES="NC(C', 'C)O"'))) == 'NC(CC)O'
+    assert get_smiles(DummyBGC(None)) is None
+    assert get_smiles(DummyBGC(str(tmp_path / 'missing.gbk'))) is None
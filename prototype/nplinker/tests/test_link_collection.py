@@ -0,0 +1,153 @@
+# Copyright 2021 The NPLinker Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Tests for LinkCollection, checking the compact storage mode gives the same
+# results as the default dict of dicts mode
+
+import pytest
+
+from nplinker.scoring.methods import LinkCollection, ObjectLink
+
+class DummyObject(object):
+    # stand-in for a GCF/Spectrum
+    def __init__(self, id):
+        self.id = id
+        self.strains = []
+
+    def __repr__(self):
+        return 'DummyObject({})'.format(self.id)
+
+class DummyMethod(object):
+    # stand-in for a ScoringMethod, sorting links by their data values
+    def __init__(self, name):
+        self.name = name
+
+    def sort(self, objects, reverse=True):
+        return sorted(objects, key=lambda link: link[self], reverse=reverse)
+
+SOURCES = [DummyObject(i) for i in range(5)]
+TARGETS = [DummyObject(100 + i) for i in range(8)]
+
+def make_links(method, pairs):
+    # pairs = list of (source index, target index, score)
+    object_links = {}
+    for src, dst, score in pairs:
+        source, target = SOURCES[src], TARGETS[dst]
+        shared = [target] if score > 1 else []
+        object_links.setdefault(source, {})[target] = ObjectLink(source, target, method, score, shared)
+    return object_links
+
+METHOD_A = DummyMethod('a')
+METHOD_B = DummyMethod('b')
+
+def links_a():
+    return make_links(METHOD_A, [(0, 0, 3), (0, 1, 1), (0, 2, 2), (1, 3, 4), (2, 4, 0), (2, 5, 5), (3, 6, 2)])
+
+def links_b():
+    return make_links(METHOD_B, [(0, 2, 7), (0, 0, 6), (1, 3, 1), (1, 7, 2), (2, 6, 3), (4, 1, 1)])
+
+def summarise(lc):
+    # a plain representation of the collection contents, for comparisons
+    return [(source.id, [(target.id, sorted(m.name for m in link.methods)) for target, link in targets.items()]) for source, targets in lc.links.items()]
+
+def link_ids(links):
+    return [(link.source.id, link.target.id) for link in links]
+
+def build(and_mode, compact):
+    lc = LinkCollection(and_mode=and_mode, compact=compact)
+    lc._add_links_from_method(METHOD_A, links_a())
+    lc._add_links_from_method(METHOD_B, links_b())
+    return lc
+
+@pytest.mark.parametrize('and_mode', [True, False])
+def test_merge(and_mode):
+    default, compact = build(and_mode, False), build(and_mode, True)
+    assert summarise(compact) == summarise(default)
+    assert compact.sources == default.sources
+    assert len(compact) == len(default)
+    assert compact.method_count == default.method_count == 2
+    assert set(compact.get_all_targets()) == set(default.get_all_targets())
+
+@pytest.mark.parametrize('and_mode', [True, False])
+def test_merge_three_methods(and_mode):
+    method_c = DummyMethod('c')
+    pairs_c = [(0, 0, 1), (0, 7, 2), (1, 3, 3), (3, 6, 1), (4, 1, 2), (4, 5, 1)]
+    default, compact = build(and_mode, False), build(and_mode, True)
+    for lc in [default, compact]:
+        lc._add_links_from_method(method_c, make_links(method_c, pairs_c))
+    assert summarise(compact) == summarise(default)
+
+def test_merge_and_mode_keeps_order():
+    lc = build(True, False)
+    assert summarise(lc) == [(0, [(100, ['a', 'b']), (102, ['a', 'b'])]), (1, [(103, ['a', 'b'])])]
+
+@pytest.mark.parametrize('and_mode', [True, False])
+def test_filter_links(and_mode):
+    default, compact = build(and_mode, False), build(and_mode, True)
+    for lc in [default, compact]:
+        lc.filter_links(lambda link: METHOD_A in link.methods and link[METHOD_A] > 2)
+    assert summarise(compact) == summarise(default)
+
+@pytest.mark.parametrize('and_mode', [True, False])
+def test_filter_no_shared_strains(and_mode):
+    default, compact = build(and_mode, False), build(and_mode, True)
+    for lc in [default, compact]:
+        lc.filter_no_shared_strains()
+    assert summarise(compact) == summarise(default)
+
+def test_filter_targets():
+    default, compact = build(False, False), build(False, True)
+    for lc in [default, compact]:
+        lc.filter_targets(lambda target: target.id % 2 == 0)
+    assert summarise(compact) == summarise(default)
+    assert all(target.id % 2 == 0 for target in compact.get_all_targets())
+
+def test_filter_targets_with_sources():
+    default, compact = build(False, False), build(False, True)
+    for lc in [default, compact]:
+        # only source 0 should be affected
+        lc.filter_targets(lambda target: target.id == 102, sources=[SOURCES[0]])
+    assert summarise(compact) == summarise(default)
+    assert list(compact.links[SOURCES[0]].keys()) == [TARGETS[2]]
+    assert len(compact.links[SOURCES[1]]) == 2
+
+def test_filter_sources():
+    default, compact = build(False, False), build(False, True)
+    for lc in [default, compact]:
+        lc.filter_sources(lambda source: source.id != 1)
+    assert summarise(compact) == summarise(default)
+    assert SOURCES[1] not in compact.sources
+
+def test_filter_removes_empty_sources():
+    default, compact = build(False, False), build(False, True)
+    for lc in [default, compact]:
+        lc.filter_targets(lambda target: target.id != 101)
+    # source 4 only linked to target 101
+    assert SOURCES[4] not in default.sources
+    assert summarise(compact) == summarise(default)
+
+@pytest.mark.parametrize('strict', [True, False])
+def test_get_sorted_links(strict):
+    default, compact = build(False, False), build(False, True)
+    for source in default.sources:
+        for method in [METHOD_A, METHOD_B]:
+            assert link_ids(compact.get_sorted_links(method, source, strict=strict)) == link_ids(default.get_sorted_links(method, source, strict=strict))
+
+def test_compact_links_is_copy():
+    compact = build(False, True)
+    compact.links[SOURCES[0]].clear()
+    del compact.links[SOURCES[1]]
+    assert len(compact.links[SOURCES[0]]) == 3
+    assert SOURCES[1] in compact.sources
@@ -0,0 +1,62 @@
+# Copyright 2021 The NPLinker Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Tests that the (optional) numba kernel for the standardised Metcalf scores
+# gives the same results as the plain numpy version
+
+import numpy as np
+import pytest
+
+pytest.importorskip('numba')
+
+from nplinker.scoring import methods
+from nplinker.scoring.methods import MetcalfScoring, R_SRC_ID, R_DST_ID, R_SCORE
+
+class DummyLinkFinder(object):
+    def __init__(self, rng, max_strains):
+        self.metcalf_expected = rng.normal(size=(max_strains + 1, max_strains + 1))
+        self.metcalf_variance_sqrt = rng.uniform(0.5, 2.0, size=(max_strains + 1, max_strains + 1))
+
+def make_scoring(cutoff):
+    # skip ScoringMethod.__init__, which needs an NPLinker object
+    scoring = object.__new__(MetcalfScoring)
+    scoring.cutoff = cutoff
+    return scoring
+
+@pytest.mark.parametrize('cutoff', [None, 0.5, 100])
+@pytest.mark.parametrize('met_row', [R_SRC_ID, R_DST_ID])
+def test_kernel_matches_numpy(monkeypatch, cutoff, met_row):
+    rng = np.random.default_rng(42)
+    max_strains, num_met, num_gen, num_links = 20, 50, 30, 1000
+    linkfinder = DummyLinkFinder(rng, max_strains)
+    met_strain_counts = rng.integers(0, max_strains + 1, num_met)
+    gen_strain_counts = rng.integers(0, max_strains + 1, num_gen)
+
+    result = np.zeros((3, num_links))
+    met_ids, gen_ids = rng.integers(0, num_met, num_links), rng.integers(0, num_gen, num_links)
+    result[met_row] = met_ids
+    result[R_DST_ID if met_row == R_SRC_ID else R_SRC_ID] = gen_ids
+    result[R_SCORE] = rng.normal(scale=5.0, size=num_links)
+
+    scoring = make_scoring(cutoff)
+    gen_row = R_DST_ID if met_row == R_SRC_ID else R_SRC_ID
+    compiled = scoring._metcalf_standardise(linkfinder, result, met_strain_counts, gen_strain_counts, met_row, gen_row)
+    monkeypatch.setattr(methods, 'NUMBA_AVAILABLE', False)
+    plain = scoring._metcalf_standardise(linkfinder, result, met_strain_counts, gen_strain_counts, met_row, gen_row)
+
+    assert compiled.shape == plain.shape
+    np.testing.assert_array_equal(compiled[R_SRC_ID], plain[R_SRC_ID])
+    np.testing.assert_array_equal(compiled[R_DST_ID], plain[R_DST_ID])
+    np.testing.assert_allclose(compiled[R_SCORE], plain[R_SCORE], rtol=1e-12)
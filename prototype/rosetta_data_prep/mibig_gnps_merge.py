@@ -77,10 +77,10 @@ failing_smiles = []
 cnt = 0
 with open('compunds_structures_2.0.csv', 'r') as f:
     for l in csv.reader(f):
-        if cnt is 0:
+        if cnt == 0:
             cnt += 1
             continue
-        if len(l) is 0:
+        if len(l) == 0:
             continue
         mibig_id, compound_name, smiles, pubchem_id = l
         if smiles == '':